@@ -345,15 +345,16 @@ class AdvancedConditionEvaluator:
         if not condition_results:
             return False, ""
         
+        # Messages are only joined once the outcome is known to be a trigger
         if logic_operator == LogicOperator.AND:
-            all_true = all(result for result, _ in condition_results)
-            messages = [msg for _, msg in condition_results if msg]
-            return all_true, " AND ".join(messages) if all_true else ""
+            if not all(result for result, _ in condition_results):
+                return False, ""
+            return True, " AND ".join(msg for _, msg in condition_results if msg)
         
         elif logic_operator == LogicOperator.OR:
-            any_true = any(result for result, _ in condition_results)
-            messages = [msg for result, msg in condition_results if result and msg]
-            return any_true, " OR ".join(messages) if any_true else ""
+            if not any(result for result, _ in condition_results):
+                return False, ""
+            return True, " OR ".join(msg for result, msg in condition_results if result and msg)
         
         elif logic_operator == LogicOperator.NOT:
             # NOT operator applies to the first condition only
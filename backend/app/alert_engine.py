@@ -2,12 +2,14 @@ import asyncio
 import logging
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional, Callable
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 
+from sqlalchemy import insert
+
 from .sports_api import sports_api
 from .sms_service import sms_service
-from .database import get_db
+from .database import SessionLocal
 from .models import Match, Alert, AlertHistory
 from .metrics_calculator import metrics_calculator, MatchMetrics
 from .advanced_conditions import advanced_evaluator, AdvancedAlertCondition
@@ -37,6 +39,10 @@ class AlertCondition:
     threshold: float
     time_window: Optional[int] = None  # minutes
     user_phone: str = ""
+    team_key: str = field(init=False, repr=False)  # lowercased team, for case-insensitive matching
+    
+    def __post_init__(self):
+        self.team_key = self.team.lower()
 
 class MatchMonitor:
     def __init__(self):
@@ -44,6 +50,9 @@ class MatchMonitor:
         self.monitoring_interval = 60  # seconds
         self.active_matches = {}  # fixture_id -> match_data
         self.alert_conditions = {}  # alert_id -> AlertCondition
+        self.alerts_by_team = {}  # lowercased team -> [AlertCondition]
+        self.sms_semaphore = asyncio.Semaphore(20)  # concurrent Twilio requests
+        self.monitoring_task = None  # background start_monitoring() loop, at most one
         
     async def start_monitoring(self):
         """Start the background monitoring service"""
@@ -58,10 +67,27 @@ class MatchMonitor:
                 logger.error(f"Error in match monitoring: {e}")
                 await asyncio.sleep(30)  # Shorter sleep on error
     
+    def start_background_monitoring(self) -> bool:
+        """Run the monitoring loop as a background task, unless one is already running"""
+        if self.monitoring_task is not None and not self.monitoring_task.done():
+            return False
+        self.monitoring_task = asyncio.create_task(self.start_monitoring())
+        return True
+    
     async def stop_monitoring(self):
         """Stop the background monitoring service"""
         self.running = False
         logger.info("🛑 Stopping Match Monitor...")
+        
+        # Cancel the loop rather than letting it finish its sleep, so a start
+        # right after a stop can never leave two loops running
+        task, self.monitoring_task = self.monitoring_task, None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
     
     async def monitor_live_matches(self):
         """Monitor all live matches and evaluate alerts"""
@@ -76,12 +102,12 @@ class MatchMonitor:
             if fixture_id:
                 self.active_matches[fixture_id] = match_data
         
-        # Remove finished matches
-        finished_matches = []
-        for fixture_id, match_data in self.active_matches.items():
-            status = match_data.get("fixture", {}).get("status", {}).get("short", "")
-            if status in ["FT", "AET", "PEN"]:  # Full Time, Extra Time, Penalties
-                finished_matches.append(fixture_id)
+        # Remove finished matches (Full Time, Extra Time, Penalties)
+        finished_matches = [
+            fixture_id
+            for fixture_id, match_data in self.active_matches.items()
+            if match_data.get("fixture", {}).get("status", {}).get("short", "") in ("FT", "AET", "PEN")
+        ]
         
         for fixture_id in finished_matches:
             del self.active_matches[fixture_id]
@@ -96,48 +122,75 @@ class MatchMonitor:
     async def load_active_alerts(self):
         """Load all active alerts from database"""
         try:
-            db = next(get_db())
-            alerts = db.query(Alert).filter(Alert.is_active == True).all()
-            
-            self.alert_conditions = {}
-            for alert in alerts:
-                condition = AlertCondition(
-                    alert_id=alert.id,
-                    alert_type=AlertType(alert.alert_type),
-                    team=alert.team,
-                    condition=alert.condition,
-                    threshold=alert.threshold,
-                    time_window=alert.time_window,
-                    user_phone=alert.user_phone
-                )
-                self.alert_conditions[alert.id] = condition
+            with SessionLocal() as db:
+                # Only the columns AlertCondition needs, streamed in batches
+                alerts = db.query(
+                    Alert.id,
+                    Alert.alert_type,
+                    Alert.team,
+                    Alert.condition,
+                    Alert.threshold,
+                    Alert.time_window,
+                    Alert.user_phone
+                ).filter(Alert.is_active == True).yield_per(1000)
+                
+                self.alert_conditions = {}
+                self.alerts_by_team = {}
+                for alert in alerts:
+                    condition = AlertCondition(
+                        alert_id=alert.id,
+                        alert_type=AlertType(alert.alert_type),
+                        team=alert.team,
+                        condition=alert.condition,
+                        threshold=alert.threshold,
+                        time_window=alert.time_window,
+                        user_phone=alert.user_phone
+                    )
+                    self.alert_conditions[alert.id] = condition
+                    self.alerts_by_team.setdefault(condition.team_key, []).append(condition)
+                    
+                logger.info(f"📋 Loaded {len(self.alert_conditions)} active alerts")
                 
-            logger.info(f"📋 Loaded {len(self.alert_conditions)} active alerts")
-            
         except Exception as e:
             logger.error(f"Error loading alerts: {e}")
     
     async def evaluate_match_alerts(self, fixture_id: int, match_data: Dict):
         """Evaluate all alerts for a specific match"""
         match_info = sports_api.format_match_data(match_data)
+        home_team = match_info.get("home_team", "").lower()
+        away_team = match_info.get("away_team", "").lower()
         
-        # Calculate advanced metrics
-        metrics = metrics_calculator.calculate_all_metrics(match_data)
+        # Check each distinct team once rather than every alert, and only
+        # calculate advanced metrics when some alert applies to this match
+        metrics = None
+        # History rows for this match only, written together afterwards; kept
+        # local so overlapping evaluations never share a batch
+        pending_history = []
+        evaluations = []
+        for team, conditions in self.alerts_by_team.items():
+            if team not in home_team and team not in away_team:
+                continue
+            if metrics is None:
+                metrics = metrics_calculator.calculate_all_metrics(match_data)
+            for condition in conditions:
+                evaluations.append(self.evaluate_single_alert(condition.alert_id, condition, match_info, metrics, pending_history))
         
-        for alert_id, condition in self.alert_conditions.items():
-            # Check if this alert applies to this match
-            if self.matches_alert_criteria(match_info, condition):
-                await self.evaluate_single_alert(alert_id, condition, match_info, metrics)
+        # Evaluate concurrently so SMS round-trips for triggered alerts overlap
+        try:
+            await asyncio.gather(*evaluations)
+        finally:
+            if pending_history:
+                self.insert_alert_history(pending_history)
     
     def matches_alert_criteria(self, match_info: Dict, condition: AlertCondition) -> bool:
         """Check if a match matches the alert criteria"""
         home_team = match_info.get("home_team", "").lower()
         away_team = match_info.get("away_team", "").lower()
-        target_team = condition.team.lower()
+        target_team = condition.team_key
         
         return target_team in home_team or target_team in away_team
     
-    async def evaluate_single_alert(self, alert_id: int, condition: AlertCondition, match_info: Dict, metrics: MatchMetrics):
+    async def evaluate_single_alert(self, alert_id: int, condition: AlertCondition, match_info: Dict, metrics: MatchMetrics, pending_history: Optional[List[Dict]] = None):
         """Evaluate a single alert condition"""
         try:
             # Check if alert was already triggered for this match
@@ -165,7 +218,7 @@ class MatchMonitor:
             
             # Send alert if triggered
             if triggered:
-                await self.send_alert(alert_id, condition, match_info, trigger_message)
+                await self.send_alert(alert_id, condition, match_info, trigger_message, pending_history)
                 
         except Exception as e:
             logger.error(f"Error evaluating alert {alert_id}: {e}")
@@ -238,7 +291,7 @@ class MatchMonitor:
     def evaluate_xg_alert(self, condition: AlertCondition, metrics: MatchMetrics) -> tuple[bool, str]:
         """Evaluate xG-based alert"""
         target_team = condition.team
-        team_xg = metrics.home_xg if target_team.lower() in metrics.home_team.lower() else metrics.away_xg
+        team_xg = metrics.home_xg if condition.team_key in metrics.home_team.lower() else metrics.away_xg
         
         if team_xg >= condition.threshold:
             return True, f"{target_team} xG: {team_xg:.2f} >= {condition.threshold}"
@@ -248,7 +301,7 @@ class MatchMonitor:
     def evaluate_momentum_alert(self, condition: AlertCondition, metrics: MatchMetrics) -> tuple[bool, str]:
         """Evaluate momentum-based alert"""
         target_team = condition.team
-        team_momentum = metrics.home_momentum if target_team.lower() in metrics.home_team.lower() else metrics.away_momentum
+        team_momentum = metrics.home_momentum if condition.team_key in metrics.home_team.lower() else metrics.away_momentum
         
         if team_momentum >= condition.threshold:
             return True, f"{target_team} momentum: {team_momentum:.1f} >= {condition.threshold}"
@@ -258,7 +311,7 @@ class MatchMonitor:
     def evaluate_pressure_alert(self, condition: AlertCondition, metrics: MatchMetrics) -> tuple[bool, str]:
         """Evaluate pressure-based alert"""
         target_team = condition.team
-        team_pressure = metrics.home_pressure_index if target_team.lower() in metrics.home_team.lower() else metrics.away_pressure_index
+        team_pressure = metrics.home_pressure_index if condition.team_key in metrics.home_team.lower() else metrics.away_pressure_index
         
         if team_pressure >= condition.threshold:
             return True, f"{target_team} pressure: {team_pressure:.2f} >= {condition.threshold}"
@@ -268,7 +321,7 @@ class MatchMonitor:
     def evaluate_win_probability_alert(self, condition: AlertCondition, metrics: MatchMetrics) -> tuple[bool, str]:
         """Evaluate win probability alert"""
         target_team = condition.team
-        team_win_prob = metrics.home_win_probability if target_team.lower() in metrics.home_team.lower() else metrics.away_win_probability
+        team_win_prob = metrics.home_win_probability if condition.team_key in metrics.home_team.lower() else metrics.away_win_probability
         
         if team_win_prob >= condition.threshold:
             return True, f"{target_team} win probability: {team_win_prob:.1%} >= {condition.threshold:.1%}"
@@ -278,19 +331,20 @@ class MatchMonitor:
     async def alert_already_triggered(self, alert_id: int, match_id: str) -> bool:
         """Check if alert was already triggered for this match"""
         try:
-            db = next(get_db())
-            existing = db.query(AlertHistory).filter(
-                AlertHistory.alert_id == alert_id,
-                AlertHistory.match_id == match_id
-            ).first()
-            
-            return existing is not None
-            
+            with SessionLocal() as db:
+                # Select only the id; the match_data snapshot is never needed here
+                existing = db.query(AlertHistory.id).filter(
+                    AlertHistory.alert_id == alert_id,
+                    AlertHistory.match_id == match_id
+                ).first()
+                
+                return existing is not None
+                
         except Exception as e:
             logger.error(f"Error checking alert history: {e}")
             return False
     
-    async def send_alert(self, alert_id: int, condition: AlertCondition, match_info: Dict, trigger_message: str):
+    async def send_alert(self, alert_id: int, condition: AlertCondition, match_info: Dict, trigger_message: str, pending_history: Optional[List[Dict]] = None):
         """Send SMS alert and record in history"""
         try:
             # Format alert message
@@ -305,35 +359,44 @@ class MatchMonitor:
             
             # Send SMS
             if condition and condition.user_phone:
-                result = sms_service.send_alert(condition.user_phone, message)
+                # Twilio's client blocks, so send from a worker thread
+                async with self.sms_semaphore:
+                    result = await asyncio.to_thread(sms_service.send_alert, condition.user_phone, message)
                 logger.info(f"📱 Alert {alert_id} sent: {result.get('success', False)}")
             else:
                 logger.info(f"📱 Alert {alert_id} triggered (no phone number configured)")
             
             # Record in history
-            await self.record_alert_history(alert_id, match_info, trigger_message, result)
+            await self.record_alert_history(alert_id, match_info, trigger_message, result, pending_history)
             
         except Exception as e:
             logger.error(f"Error sending alert {alert_id}: {e}")
     
-    async def record_alert_history(self, alert_id: int, match_info: Dict, trigger_message: str, sms_result: Dict):
+    async def record_alert_history(self, alert_id: int, match_info: Dict, trigger_message: str, sms_result: Dict, pending_history: Optional[List[Dict]] = None):
         """Record alert trigger in history"""
+        row = {
+            "alert_id": alert_id,
+            "match_id": match_info.get("external_id"),
+            "triggered_at": datetime.utcnow(),
+            "trigger_message": trigger_message,
+            "sms_sent": sms_result.get("success", False),
+            "sms_message_id": sms_result.get("message_sid", ""),
+            "match_data": match_info
+        }
+        
+        # While a match is being evaluated, rows are written together afterwards
+        if pending_history is not None:
+            pending_history.append(row)
+        else:
+            self.insert_alert_history([row])
+    
+    def insert_alert_history(self, rows: List[Dict]):
+        """Insert alert history rows with a single executemany INSERT"""
         try:
-            db = next(get_db())
-            
-            history = AlertHistory(
-                alert_id=alert_id,
-                match_id=match_info.get("external_id"),
-                triggered_at=datetime.utcnow(),
-                trigger_message=trigger_message,
-                sms_sent=sms_result.get("success", False),
-                sms_message_id=sms_result.get("message_sid", ""),
-                match_data=str(match_info)
-            )
-            
-            db.add(history)
-            db.commit()
-            
+            with SessionLocal() as db:
+                db.execute(insert(AlertHistory), rows)
+                db.commit()
+                
         except Exception as e:
             logger.error(f"Error recording alert history: {e}")
 
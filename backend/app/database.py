@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import Text, create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
 import os
 from .models import Base
@@ -6,8 +6,21 @@ from .models import Base
 # Database URL from environment variable
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./touchline.db")
 
+# Connection pool settings for server databases (SQLite manages its own pool).
+# Sized per worker process, so keep pool_size + max_overflow times the number
+# of workers under the server's max_connections
+engine_options = {}
+if not DATABASE_URL.startswith("sqlite"):
+    engine_options = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_recycle": 1800,  # seconds; replace connections before server idle timeouts
+        "pool_pre_ping": True,  # detect connections dropped by a database restart
+        "pool_use_lifo": True,  # reuse the most recently returned (warm) connection
+    }
+
 # Create engine
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, **engine_options)
 
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -20,6 +33,36 @@ def get_db():
     finally:
         db.close()
 
+# Dependency for read-only Core queries; a pooled connection without the
+# Session and its unit-of-work bookkeeping
+def get_connection():
+    with engine.connect() as conn:
+        yield conn
+
+# alert_history.match_data used to be Text holding str(dict) reprs, which
+# the JSON column type cannot decode. create_all never alters existing
+# columns, so clear those legacy values in place
+def upgrade_alert_history_match_data():
+    columns = {column["name"]: column["type"] for column in inspect(engine).get_columns("alert_history")}
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            if isinstance(columns["match_data"], Text):
+                conn.execute(text("ALTER TABLE alert_history ALTER COLUMN match_data TYPE JSONB USING NULL"))
+        elif engine.dialect.name == "sqlite":
+            conn.execute(text(
+                "UPDATE alert_history SET match_data = NULL "
+                "WHERE match_data IS NOT NULL AND NOT json_valid(match_data)"
+            ))
+
+# create_all skips existing tables along with their indexes, so indexes
+# added to a model later are created here; checkfirst skips existing ones
+def create_missing_indexes():
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
 # Create all tables
 def create_tables():
-    Base.metadata.create_all(bind=engine) 
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    create_missing_indexes()
+    upgrade_alert_history_match_data() 
\ No newline at end of file
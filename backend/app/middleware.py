@@ -1,18 +1,129 @@
-from fastapi import Request, HTTPException
+from fastapi import Request
 from fastapi.middleware.cors import CORSMiddleware
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
+from limits import RateLimitItem, parse
+from limits.aio.strategies import SlidingWindowCounterRateLimiter
+from limits.storage import storage_from_string
+import html
+import ipaddress
+import math
+import os
+import re
 import time
 import logging
-from typing import List
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional
+from .responses import ORJSONResponse
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Rate limiter
-limiter = Limiter(key_func=get_remote_address)
+# Reverse proxies whose X-Forwarded-For is believed, as addresses or CIDR
+# networks. Anyone else can reach the app port directly and forge the header
+TRUSTED_PROXIES = tuple(
+    ipaddress.ip_network(proxy.strip())
+    for proxy in os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1").split(",")
+    if proxy.strip()
+)
+
+def is_trusted_proxy(host: Optional[str]) -> bool:
+    """Check whether a peer address belongs to a trusted reverse proxy"""
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+def get_client_identifier(request: Request) -> str:
+    """Identify the client for rate limiting, behind the nginx reverse proxy"""
+    # Resolved once per request and shared through the request scope
+    client_id = getattr(request.state, "client_id", None)
+    if client_id is not None:
+        return client_id
+    
+    client_id = get_remote_address(request)
+    forwarded_for = request.headers.get("x-forwarded-for")
+    if forwarded_for and is_trusted_proxy(client_id):
+        # nginx appends the peer address ($proxy_add_x_forwarded_for), so the
+        # last hop is the one a client can't spoof
+        client_id = forwarded_for.rpartition(",")[2].strip()
+    
+    request.state.client_id = client_id
+    return client_id
+
+# Rate limiting. Counters live in Redis when REDIS_URL is set so limits hold
+# across all workers; limits' Redis storage updates them with atomic Lua scripts.
+# The sliding window counter keeps two counters per key (O(1) per request)
+# and smooths out the 2x burst a fixed window allows at its boundary.
+# Every counter expires with its window (the memory storage sweeps expired
+# keys on a timer, Redis keys carry a TTL), so idle clients never accumulate.
+RATE_LIMIT_STORAGE_URI = os.getenv("REDIS_URL", "memory://")
+
+# slowapi's limiter, for @limiter.limit route decorators
+limiter = Limiter(
+    key_func=get_client_identifier,
+    strategy="sliding-window-counter",
+    storage_uri=RATE_LIMIT_STORAGE_URI
+)
+
+# The request middleware checks limits on the async storage (redis-py's
+# asyncio client), so the Redis round-trip never blocks the event loop
+rate_limiter = SlidingWindowCounterRateLimiter(
+    storage_from_string(
+        f"async+{RATE_LIMIT_STORAGE_URI}",
+        **({"implementation": "redispy"} if RATE_LIMIT_STORAGE_URI.startswith("redis") else {})
+    )
+)
+
+# Stricter limits for sensitive endpoints, parsed once at import
+AUTH_RATE_LIMIT = parse("5/minute")  # 5 requests per minute for auth endpoints
+ALERTS_RATE_LIMIT = parse("10/minute")  # 10 requests per minute for alert endpoints
+
+@dataclass(frozen=True, slots=True)
+class EndpointRateLimit:
+    """Rate limit applied to every path under a prefix"""
+    prefix: str
+    limit: RateLimitItem
+    limit_header: str = field(init=False)  # X-RateLimit-Limit value
+    
+    def __post_init__(self):
+        object.__setattr__(self, "limit_header", str(self.limit.amount))
+
+# Checked in order
+ENDPOINT_RATE_LIMITS = (
+    EndpointRateLimit("/api/auth", AUTH_RATE_LIMIT),
+    EndpointRateLimit("/api/alerts", ALERTS_RATE_LIMIT),
+)
+
+@dataclass(frozen=True, slots=True)
+class RateLimitResult:
+    """Outcome of a rate limit check, reused for the response headers"""
+    allowed: bool
+    endpoint_limit: EndpointRateLimit
+    reset_time: Optional[float] = None  # only read for rejected requests
+
+# Paths outside these prefixes skip rate limiting with one str.startswith call
+RATE_LIMITED_PREFIXES = tuple(endpoint_limit.prefix for endpoint_limit in ENDPOINT_RATE_LIMITS)
+
+@lru_cache(maxsize=4096)
+def _get_endpoint_rate_limit(path: str) -> Optional[EndpointRateLimit]:
+    """Resolve the rate limit for a request path, memoized per path"""
+    for endpoint_limit in ENDPOINT_RATE_LIMITS:
+        if path.startswith(endpoint_limit.prefix):
+            return endpoint_limit
+    return None
+
+SECURITY_HEADERS = {
+    "X-Content-Type-Options": "nosniff",
+    "X-Frame-Options": "DENY",
+    "X-XSS-Protection": "1; mode=block",
+    "Referrer-Policy": "strict-origin-when-cross-origin",
+    "Permissions-Policy": "geolocation=(), microphone=(), camera=()",
+}
 
 def setup_middleware(app):
     """Setup all middleware for the FastAPI application"""
@@ -21,7 +132,38 @@ def setup_middleware(app):
     app.state.limiter = limiter
     app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
     
-    # CORS middleware
+    # Security headers, request logging and rate limiting share one layer:
+    # every @app.middleware("http") adds its own task and response stream hop
+    @app.middleware("http")
+    async def request_middleware(request: Request, call_next):
+        start_time = time.perf_counter()
+        
+        # Log request
+        logger.info("Request: %s %s", request.method, request.url)
+        
+        # Rate limiting for specific endpoints
+        rate_limit_result = await _check_rate_limit(request)
+        if rate_limit_result is not None and not rate_limit_result.allowed:
+            response = ORJSONResponse(status_code=429, content={"detail": "Too many requests"})
+        else:
+            response = await call_next(request)
+        if rate_limit_result is not None:
+            response.headers.update(format_rate_limit_headers(rate_limit_result))
+        
+        # Security headers
+        response.headers.update(SECURITY_HEADERS)
+        
+        # Remove server information
+        if "server" in response.headers:
+            del response.headers["server"]
+        
+        # Log response time
+        process_time = time.perf_counter() - start_time
+        logger.info("Response: %s - %.3fs", response.status_code, process_time)
+        
+        return response
+    
+    # CORS middleware, added last so it wraps the rest and 429s carry CORS headers
     app.add_middleware(
         CORSMiddleware,
         allow_origins=[
@@ -33,56 +175,47 @@ def setup_middleware(app):
         allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
         allow_headers=["*"],
     )
+
+async def _check_rate_limit(request: Request) -> Optional[RateLimitResult]:
+    """Record the request against its endpoint limit, if any"""
+    path = request.url.path
+    if not path.startswith(RATE_LIMITED_PREFIXES):
+        return None
     
-    # Security headers middleware
-    @app.middleware("http")
-    async def add_security_headers(request: Request, call_next):
-        response = await call_next(request)
-        
-        # Security headers
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        response.headers["Permissions-Policy"] = "geolocation=(), microphone=(), camera=()"
-        
-        # Remove server information
-        response.headers.pop("Server", None)
-        
-        return response
+    # Apply stricter rate limiting to sensitive endpoints
+    endpoint_limit = _get_endpoint_rate_limit(path)
+    if endpoint_limit is None:
+        return None
+    rate_limit, scope = endpoint_limit.limit, endpoint_limit.prefix
     
-    # Request logging middleware
-    @app.middleware("http")
-    async def log_requests(request: Request, call_next):
-        start_time = time.time()
-        
-        # Log request
-        logger.info(f"Request: {request.method} {request.url}")
-        
-        response = await call_next(request)
-        
-        # Log response time
-        process_time = time.time() - start_time
-        logger.info(f"Response: {response.status_code} - {process_time:.3f}s")
-        
-        return response
+    client_id = get_client_identifier(request)
     
-    # Rate limiting for specific endpoints
-    @app.middleware("http")
-    async def rate_limit_middleware(request: Request, call_next):
-        # Apply stricter rate limiting to sensitive endpoints
-        if request.url.path.startswith("/api/auth"):
-            # 5 requests per minute for auth endpoints
-            if limiter.is_rate_limited(request, "5/minute"):
-                raise HTTPException(status_code=429, detail="Too many requests")
-        
-        elif request.url.path.startswith("/api/alerts"):
-            # 10 requests per minute for alert endpoints
-            if limiter.is_rate_limited(request, "10/minute"):
-                raise HTTPException(status_code=429, detail="Too many requests")
-        
-        response = await call_next(request)
-        return response
+    # hit() checks and records the request in one storage call, against a
+    # single clock reading. Only rejected requests pay for a second read,
+    # the window stats behind Retry-After (two counter reads, no scan)
+    try:
+        if await rate_limiter.hit(rate_limit, scope, client_id):
+            return RateLimitResult(True, endpoint_limit)
+        reset_time, _ = await rate_limiter.get_window_stats(rate_limit, scope, client_id)
+    except Exception as e:
+        # Fail open if the rate limit storage is unreachable
+        logger.error(f"Rate limit storage error: {e}")
+        return None
+    
+    return RateLimitResult(False, endpoint_limit, reset_time)
+
+def format_rate_limit_headers(result: RateLimitResult) -> Dict[str, str]:
+    """Build the X-RateLimit-* (and Retry-After) headers for a checked request"""
+    headers = {"X-RateLimit-Limit": result.endpoint_limit.limit_header}
+    if not result.allowed:
+        headers["X-RateLimit-Remaining"] = "0"
+        headers["X-RateLimit-Reset"] = str(int(result.reset_time))
+        headers["Retry-After"] = str(max(1, math.ceil(result.reset_time - time.time())))
+    return headers
+
+# Validation patterns, compiled once at import
+PHONE_NUMBER_PATTERN = re.compile(r'^\+?1?\d{9,15}$')  # Basic phone validation (adjust for your needs)
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
 
 class SecurityMiddleware:
     """Additional security middleware"""
@@ -90,20 +223,14 @@ class SecurityMiddleware:
     @staticmethod
     def validate_phone_number(phone: str) -> bool:
         """Validate phone number format"""
-        import re
-        # Basic phone validation (adjust for your needs)
-        pattern = r'^\+?1?\d{9,15}$'
-        return bool(re.match(pattern, phone))
+        return PHONE_NUMBER_PATTERN.match(phone) is not None
     
     @staticmethod
     def sanitize_input(text: str) -> str:
         """Basic input sanitization"""
-        import html
         return html.escape(text.strip())
     
     @staticmethod
     def validate_email(email: str) -> bool:
         """Validate email format"""
-        import re
-        pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        return bool(re.match(pattern, email)) 
\ No newline at end of file
+        return EMAIL_PATTERN.match(email) is not None
\ No newline at end of file
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float, Text
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float, Text, Index, JSON
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -31,6 +32,11 @@ class Match(Base):
     home_score = Column(Integer, default=0)
     away_score = Column(Integer, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_matches_status", "status"),  # live match listing
+        Index("ix_matches_start_time", "start_time"),  # today's match listing
+    )
 
 class Alert(Base):
     __tablename__ = "alerts"
@@ -49,6 +55,13 @@ class Alert(Base):
     
     user = relationship("User", back_populates="alerts")
     history = relationship("AlertHistory", back_populates="alert")
+    
+    __table_args__ = (
+        Index("ix_alerts_user_active", "user_id", "is_active"),  # a user's active alerts
+        Index("ix_alerts_type_active", "alert_type", "is_active"),  # active alerts by type
+        Index("ix_alerts_is_active", "is_active"),  # active alert loads and counts
+        Index("ix_alerts_created_at", "created_at"),  # newest-first alert listing
+    )
 
 class AlertHistory(Base):
     __tablename__ = "alert_history"
@@ -60,6 +73,12 @@ class AlertHistory(Base):
     trigger_message = Column(Text)  # what triggered the alert
     sms_sent = Column(Boolean, default=False)
     sms_message_id = Column(String, nullable=True)  # Twilio message SID
-    match_data = Column(Text, nullable=True)  # JSON string of match data
+    match_data = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=True)  # match data snapshot
+    
+    alert = relationship("Alert", back_populates="history")
     
-    alert = relationship("Alert", back_populates="history") 
\ No newline at end of file
+    __table_args__ = (
+        Index("ix_alerthistory_alert_match", "alert_id", "match_id"),  # already-triggered check
+        Index("ix_alerthistory_alert_time", "alert_id", "triggered_at"),  # an alert's recent triggers
+        Index("ix_alerthistory_triggered_at", "triggered_at"),  # analytics windows, latest trigger
+    ) 
\ No newline at end of file
@@ -1,13 +1,16 @@
+import asyncio
 import time
 import logging
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
 from fastapi import Request, Response
-import json
+from starlette.middleware.base import BaseHTTPMiddleware
+import orjson
 import redis
+from sqlalchemy import case, func
 from sqlalchemy.orm import Session
-from .database import get_db
+from .database import SessionLocal
 from .models import Alert, AlertHistory, User
 
 # Configure logging
@@ -23,136 +26,264 @@ ACTIVE_USERS = Gauge('active_users', 'Number of active users')
 ACTIVE_ALERTS = Gauge('active_alerts', 'Number of active alerts')
 LIVE_MATCHES = Gauge('live_matches', 'Number of live matches')
 
+# Seconds between user/alert COUNT refreshes
+USER_METRICS_TTL = 10
+
+# Seconds alert analytics are served from cache, and the recompute lock lifetime
+ANALYTICS_CACHE_TTL = 60
+ANALYTICS_LOCK_TTL = 10
+ANALYTICS_STALE_TTL = 600  # seconds the previous result is kept for callers that miss the lock
+
+# Seconds a performance metrics snapshot is reused
+PERFORMANCE_CACHE_TTL = 1.0
+
+def _empty_alert_analytics() -> Dict:
+    """Analytics reported when the database can't be queried"""
+    return {
+        "total_triggers": 0,
+        "triggers_by_type": {},
+        "triggers_by_team": {},
+        "success_rate": 0,
+        "daily_triggers": []
+    }
+
 class MonitoringService:
     def __init__(self, redis_client: redis.Redis):
         self.redis = redis_client
         self.start_time = datetime.utcnow()
+        self._request_counters = {}  # (method, endpoint, status) -> bound REQUEST_COUNT child
+        self._today_end = 0.0  # epoch seconds at which _today_str goes stale
+        self._today_str = ""
+        self._performance_cache = (0.0, {})  # (monotonic timestamp, metrics dict)
+        self._gauge_values = {}  # gauge -> last value passed to set()
     
     def track_request(self, request: Request, response: Response, duration: float):
         """Track HTTP request metrics"""
-        REQUEST_COUNT.labels(
-            method=request.method,
-            endpoint=request.url.path,
-            status=response.status_code
-        ).inc()
+        # Label by route template, not raw path: ids and scanner 404s would
+        # otherwise create a new child (and cache entry) per distinct URL
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        
+        # Reuse the bound child instead of resolving labels on every request;
+        # it mirrors the children REQUEST_COUNT already keeps
+        key = (request.method, endpoint, response.status_code)
+        counter = self._request_counters.get(key)
+        if counter is None:
+            counter = self._request_counters[key] = REQUEST_COUNT.labels(*key)
+        counter.inc()
         
         REQUEST_DURATION.observe(duration)
         
-        # Log request details
-        logger.info(f"Request: {request.method} {request.url.path} - {response.status_code} - {duration:.3f}s")
+        # Log request details; formatting is deferred until the record is emitted
+        logger.info("Request: %s %s - %s - %.3fs", request.method, request.url.path, response.status_code, duration)
+    
+    def _today(self) -> str:
+        """Today's UTC date string for the daily Redis keys, formatted once per day"""
+        now = time.time()
+        if now >= self._today_end:
+            # Unix time has no leap seconds, so UTC midnight is a multiple of 86400
+            today_start = now - now % 86400
+            self._today_end = today_start + 86400
+            self._today_str = time.strftime('%Y-%m-%d', time.gmtime(today_start))
+        return self._today_str
     
     def track_alert_trigger(self, alert_type: str, team: str):
         """Track alert trigger metrics"""
         ALERT_TRIGGER_COUNT.labels(alert_type=alert_type, team=team).inc()
         
-        # Store in Redis for real-time analytics
-        key = f"alert_triggers:{datetime.utcnow().strftime('%Y-%m-%d')}"
-        self.redis.hincrby(key, f"{alert_type}:{team}", 1)
-        self.redis.expire(key, 86400)  # 24 hours
+        # Store in Redis for real-time analytics (one round-trip)
+        key = f"alert_triggers:{self._today()}"
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hincrby(key, f"{alert_type}:{team}", 1)
+        pipe.expire(key, 86400)  # 24 hours
+        pipe.execute()
     
     def track_sms_sent(self, success: bool = True):
         """Track SMS sending metrics"""
         SMS_SENT_COUNT.inc()
         
-        # Store SMS metrics
-        key = f"sms_metrics:{datetime.utcnow().strftime('%Y-%m-%d')}"
-        self.redis.hincrby(key, "sent", 1)
+        # Store SMS metrics (one round-trip)
+        key = f"sms_metrics:{self._today()}"
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hincrby(key, "sent", 1)
         if not success:
-            self.redis.hincrby(key, "failed", 1)
-        self.redis.expire(key, 86400)
+            pipe.hincrby(key, "failed", 1)
+        pipe.expire(key, 86400)
+        pipe.execute()
+    
+    def _set_gauge(self, gauge: Gauge, value: float):
+        """Set a gauge only when its value changed since the last update"""
+        if self._gauge_values.get(gauge) != value:
+            gauge.set(value)
+            self._gauge_values[gauge] = value
     
     def update_user_metrics(self, db: Session):
         """Update user-related metrics"""
+        # The counts are refreshed at most once per TTL across all workers;
+        # SET NX only succeeds for the first caller after the key expires
+        if not self.redis.set("metrics:user_metrics_fresh", 1, ex=USER_METRICS_TTL, nx=True):
+            # Another worker ran the COUNTs; the gauges are per process, so
+            # copy its shared results into this worker's gauges
+            active_users, active_alerts = self.redis.mget("metrics:active_users", "metrics:active_alerts")
+            if active_users is not None:
+                self._set_gauge(ACTIVE_USERS, int(active_users))
+            if active_alerts is not None:
+                self._set_gauge(ACTIVE_ALERTS, int(active_alerts))
+            return
+        
         try:
-            active_users = db.query(User).filter(User.is_active == True).count()
-            ACTIVE_USERS.set(active_users)
+            active_users = db.query(func.count(User.id)).filter(User.is_active == True).scalar()
+            self._set_gauge(ACTIVE_USERS, active_users)
             
-            active_alerts = db.query(Alert).filter(Alert.is_active == True).count()
-            ACTIVE_ALERTS.set(active_alerts)
+            active_alerts = db.query(func.count(Alert.id)).filter(Alert.is_active == True).scalar()
+            self._set_gauge(ACTIVE_ALERTS, active_alerts)
             
-            # Store in Redis
-            self.redis.set("metrics:active_users", active_users)
-            self.redis.set("metrics:active_alerts", active_alerts)
+            # Store in Redis for the other workers and the health endpoint
+            self.redis.mset({"metrics:active_users": active_users, "metrics:active_alerts": active_alerts})
             
         except Exception as e:
             logger.error(f"Error updating user metrics: {e}")
+            self.redis.delete("metrics:user_metrics_fresh")
+    
+    async def refresh_user_metrics(self, interval: int = USER_METRICS_TTL):
+        """Refresh user-related metrics in the background, off the request path"""
+        while True:
+            db = SessionLocal()
+            try:
+                # The COUNT queries block, so run them off the event loop
+                await asyncio.to_thread(self.update_user_metrics, db)
+            except Exception as e:
+                logger.error(f"Error refreshing user metrics: {e}")
+            finally:
+                db.close()
+            await asyncio.sleep(interval)
     
     def update_match_metrics(self, live_matches_count: int):
         """Update match-related metrics"""
-        LIVE_MATCHES.set(live_matches_count)
+        self._set_gauge(LIVE_MATCHES, live_matches_count)
         self.redis.set("metrics:live_matches", live_matches_count)
     
     def get_alert_analytics(self, days: int = 7) -> Dict:
         """Get alert analytics for the last N days"""
-        analytics = {
-            "total_triggers": 0,
-            "triggers_by_type": {},
-            "triggers_by_team": {},
-            "success_rate": 0,
-            "daily_triggers": []
-        }
+        cache_key = f"analytics:alerts:{days}"
+        stale_key = f"{cache_key}:stale"
+        # redis-py's lock stores a per-holder token and only releases its own
+        lock = self.redis.lock(f"{cache_key}:lock", timeout=ANALYTICS_LOCK_TTL, blocking=False)
+        owns_lock = False
+        
+        # Serve from cache; on a miss only the lock holder recomputes, others
+        # get the previous result from the longer-lived stale copy instead of
+        # stampeding the database. Nothing here waits on the lock holder
+        try:
+            cached = self.redis.get(cache_key)
+            if cached is not None:
+                return orjson.loads(cached)
+            owns_lock = lock.acquire()
+            if not owns_lock:
+                stale = self.redis.get(stale_key)
+                if stale is not None:
+                    return orjson.loads(stale)
+        except redis.RedisError as e:
+            # Without Redis, fall back to querying the database directly
+            logger.error(f"Error reading cached alert analytics: {e}")
+        
+        try:
+            analytics = self._query_alert_analytics(days)
+        except Exception as e:
+            logger.error(f"Error getting alert analytics: {e}")
+            analytics = None
         
         try:
-            # Get alert history from database
-            db = next(get_db())
+            if analytics is not None:
+                body = orjson.dumps(analytics)
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.set(cache_key, body, ex=ANALYTICS_CACHE_TTL)
+                pipe.set(stale_key, body, ex=ANALYTICS_STALE_TTL)
+                pipe.execute()
+            if owns_lock:
+                lock.release()
+        except redis.RedisError as e:
+            logger.error(f"Error caching alert analytics: {e}")
+        
+        return analytics if analytics is not None else _empty_alert_analytics()
+    
+    def _query_alert_analytics(self, days: int) -> Dict:
+        """Compute alert analytics for the last N days from the database"""
+        analytics = _empty_alert_analytics()
+        
+        # Get alert history from database
+        with SessionLocal() as db:
             start_date = datetime.utcnow() - timedelta(days=days)
             
-            alert_history = db.query(AlertHistory).filter(
+            # Trigger count and SMS success rate in one aggregate query
+            total_triggers, successful_sms = db.query(
+                func.count(AlertHistory.id),
+                func.sum(case((AlertHistory.sms_sent == True, 1), else_=0))
+            ).filter(
                 AlertHistory.triggered_at >= start_date
-            ).all()
+            ).one()
             
-            analytics["total_triggers"] = len(alert_history)
+            analytics["total_triggers"] = total_triggers
+            analytics["success_rate"] = (successful_sms / total_triggers * 100) if total_triggers else 0
             
-            # Calculate success rate
-            successful_sms = sum(1 for alert in alert_history if alert.sms_sent)
-            analytics["success_rate"] = (successful_sms / len(alert_history) * 100) if alert_history else 0
+            # Group by alert type and team in a single JOIN + GROUP BY
+            grouped_triggers = db.query(
+                Alert.alert_type, Alert.team, func.count(AlertHistory.id)
+            ).join(
+                Alert, Alert.id == AlertHistory.alert_id
+            ).filter(
+                AlertHistory.triggered_at >= start_date
+            ).group_by(Alert.alert_type, Alert.team).all()
             
-            # Group by alert type and team
-            for alert in alert_history:
-                alert_obj = db.query(Alert).filter(Alert.id == alert.alert_id).first()
-                if alert_obj:
-                    alert_type = alert_obj.alert_type
-                    team = alert_obj.team
-                    
-                    analytics["triggers_by_type"][alert_type] = analytics["triggers_by_type"].get(alert_type, 0) + 1
-                    analytics["triggers_by_team"][team] = analytics["triggers_by_team"].get(team, 0) + 1
+            for alert_type, team, count in grouped_triggers:
+                analytics["triggers_by_type"][alert_type] = analytics["triggers_by_type"].get(alert_type, 0) + count
+                analytics["triggers_by_team"][team] = analytics["triggers_by_team"].get(team, 0) + count
             
-            # Daily triggers
-            for i in range(days):
-                date = (datetime.utcnow() - timedelta(days=i)).strftime('%Y-%m-%d')
-                daily_count = db.query(AlertHistory).filter(
-                    AlertHistory.triggered_at >= datetime.strptime(date, '%Y-%m-%d'),
-                    AlertHistory.triggered_at < datetime.strptime(date, '%Y-%m-%d') + timedelta(days=1)
-                ).count()
-                
-                analytics["daily_triggers"].append({
-                    "date": date,
-                    "count": daily_count
-                })
+            # Daily triggers in a single GROUP BY; days without triggers are filled in below
+            today = datetime.utcnow().date()
+            first_day = datetime.combine(today - timedelta(days=days - 1), datetime.min.time())
+            trigger_day = func.date(AlertHistory.triggered_at)
+            daily_counts = {
+                str(day): count
+                for day, count in db.query(trigger_day, func.count(AlertHistory.id)).filter(
+                    AlertHistory.triggered_at >= first_day
+                ).group_by(trigger_day).all()
+            }
             
-        except Exception as e:
-            logger.error(f"Error getting alert analytics: {e}")
+            dates = [(today - timedelta(days=i)).isoformat() for i in range(days)]
+            analytics["daily_triggers"] = [
+                {"date": date, "count": daily_counts.get(date, 0)}
+                for date in dates
+            ]
+        
         
         return analytics
     
     def get_system_health(self) -> Dict:
         """Get system health metrics"""
+        # One round-trip for all Redis reads
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.ping()
+        pipe.mget("metrics:active_users", "metrics:active_alerts", "metrics:live_matches")
+        pipe.info("memory")
+        redis_connected, (active_users, active_alerts, live_matches), memory_info = pipe.execute()
+        
         health = {
             "uptime": (datetime.utcnow() - self.start_time).total_seconds(),
-            "redis_connected": self.redis.ping(),
-            "active_users": self.redis.get("metrics:active_users") or 0,
-            "active_alerts": self.redis.get("metrics:active_alerts") or 0,
-            "live_matches": self.redis.get("metrics:live_matches") or 0,
-            "memory_usage": self.redis.info()["used_memory_human"],
+            "redis_connected": redis_connected,
+            "active_users": active_users or 0,
+            "active_alerts": active_alerts or 0,
+            "live_matches": live_matches or 0,
+            "memory_usage": memory_info["used_memory_human"],
             "last_alert_trigger": None
         }
         
         # Get last alert trigger time
         try:
-            db = next(get_db())
-            last_alert = db.query(AlertHistory).order_by(AlertHistory.triggered_at.desc()).first()
-            if last_alert:
-                health["last_alert_trigger"] = last_alert.triggered_at.isoformat()
+            with SessionLocal() as db:
+                last_triggered_at = db.query(func.max(AlertHistory.triggered_at)).scalar()
+                if last_triggered_at:
+                    health["last_alert_trigger"] = last_triggered_at.isoformat()
         except Exception as e:
             logger.error(f"Error getting last alert trigger: {e}")
         
@@ -160,31 +291,64 @@ class MonitoringService:
     
     def get_performance_metrics(self) -> Dict:
         """Get performance metrics"""
-        return {
-            "request_rate": REQUEST_COUNT._value.sum(),
-            "average_response_time": REQUEST_DURATION.observe(0),  # This is a placeholder
-            "alert_trigger_rate": ALERT_TRIGGER_COUNT._value.sum(),
-            "sms_success_rate": SMS_SENT_COUNT._value.sum(),
+        now = time.monotonic()
+        generated_at, metrics = self._performance_cache
+        if metrics and now - generated_at <= PERFORMANCE_CACHE_TTL:
+            return metrics
+        
+        # Read the exported samples; observing a value here would add a
+        # bogus zero-duration request to the histogram
+        duration_sum = _sample_total(REQUEST_DURATION, "_sum")
+        duration_count = _sample_total(REQUEST_DURATION, "_count")
+        metrics = {
+            "request_rate": _sample_total(REQUEST_COUNT, "_total"),
+            "average_response_time": duration_sum / duration_count if duration_count else 0.0,
+            "alert_trigger_rate": _sample_total(ALERT_TRIGGER_COUNT, "_total"),
+            "sms_success_rate": _sample_total(SMS_SENT_COUNT, "_total"),
         }
+        self._performance_cache = (now, metrics)
+        return metrics
+
+def _sample_total(metric, suffix: str) -> float:
+    """Sum a metric's samples with the given suffix across all label sets"""
+    return sum(
+        sample.value
+        for family in metric.collect()
+        for sample in family.samples
+        if sample.name.endswith(suffix)
+    )
 
 # Middleware for request tracking
-async def monitoring_middleware(request: Request, call_next):
-    start_time = time.time()
-    
-    response = await call_next(request)
+class MonitoringMiddleware(BaseHTTPMiddleware):
+    """Tracks every request against the monitoring service it was mounted with"""
     
-    duration = time.time() - start_time
+    def __init__(self, app, service: MonitoringService):
+        super().__init__(app)
+        self.service = service
     
-    # Track request if monitoring service is available
-    if hasattr(request.app.state, 'monitoring'):
-        request.app.state.monitoring.track_request(request, response, duration)
-    
-    return response
+    async def dispatch(self, request: Request, call_next):
+        start_time = time.perf_counter()
+        
+        response = await call_next(request)
+        
+        self.service.track_request(request, response, time.perf_counter() - start_time)
+        
+        return response
 
 # Prometheus metrics endpoint
+METRICS_CACHE_TTL = 1.0  # seconds a serialized scrape is reused
+_metrics_cache = (0.0, b"")  # (monotonic timestamp, generate_latest() output)
+
 def metrics_endpoint():
     """Return Prometheus metrics"""
+    global _metrics_cache
+    now = time.monotonic()
+    generated_at, content = _metrics_cache
+    if not content or now - generated_at > METRICS_CACHE_TTL:
+        content = generate_latest()
+        _metrics_cache = (now, content)
+    
     return Response(
-        content=generate_latest(),
+        content=content,
         media_type=CONTENT_TYPE_LATEST
-    ) 
\ No newline at end of file
+    )
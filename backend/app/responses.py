@@ -0,0 +1,9 @@
+from typing import Any
+from fastapi.responses import JSONResponse
+import orjson
+
+class ORJSONResponse(JSONResponse):
+    """JSON response serialized with orjson (handles datetime natively)"""
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr, validator
+from pydantic import BaseModel, ConfigDict, EmailStr, field_validator
 from typing import Optional, List
 from datetime import datetime
 
@@ -11,7 +11,8 @@ class UserBase(BaseModel):
 class UserCreate(UserBase):
     password: str
     
-    @validator('password')
+    @field_validator('password')
+    @classmethod
     def validate_password(cls, v):
         if len(v) < 8:
             raise ValueError('Password must be at least 8 characters long')
@@ -28,8 +29,7 @@ class UserResponse(UserBase):
     is_active: bool
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Alert schemas
 class AlertBase(BaseModel):
@@ -60,8 +60,7 @@ class AlertResponse(AlertBase):
     is_active: bool
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Match schemas
 class MatchBase(BaseModel):
@@ -78,8 +77,7 @@ class MatchResponse(MatchBase):
     id: int
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Authentication schemas
 class Token(BaseModel):
@@ -115,12 +113,11 @@ class AlertHistoryBase(BaseModel):
     match_id: str
     trigger_message: str
     sms_sent: bool
-    match_data: Optional[str] = None
+    match_data: Optional[dict] = None
 
 class AlertHistoryResponse(AlertHistoryBase):
     id: int
     triggered_at: datetime
     sms_message_id: Optional[str] = None
     
-    class Config:
-        from_attributes = True 
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True) 
\ No newline at end of file
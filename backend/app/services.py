@@ -1,3 +1,4 @@
+import asyncio
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_
 from datetime import datetime, timedelta
@@ -11,15 +12,24 @@ class MatchService:
     async def sync_live_matches(db: Session) -> List[Match]:
         """Sync live matches from sports API to database"""
         live_matches_data = await sports_api.get_live_matches()
+        # The upsert is blocking SQLAlchemy work; keep it off the event loop
+        return await asyncio.to_thread(MatchService.upsert_matches, db, live_matches_data)
+    
+    @staticmethod
+    def upsert_matches(db: Session, live_matches_data: List[Dict]) -> List[Match]:
+        """Insert or update matches from raw sports API data"""
         synced_matches = []
+        formatted_matches = [sports_api.format_match_data(match_data) for match_data in live_matches_data]
         
-        for match_data in live_matches_data:
-            formatted_data = sports_api.format_match_data(match_data)
-            
-            # Check if match already exists
-            existing_match = db.query(Match).filter(
-                Match.external_id == formatted_data["external_id"]
-            ).first()
+        # Load every already-stored match in one IN query instead of one SELECT per match
+        external_ids = [formatted_data["external_id"] for formatted_data in formatted_matches]
+        existing_matches = {
+            match.external_id: match
+            for match in db.query(Match).filter(Match.external_id.in_(external_ids))
+        }
+        
+        for formatted_data in formatted_matches:
+            existing_match = existing_matches.get(formatted_data["external_id"])
             
             if existing_match:
                 # Update existing match
@@ -34,12 +44,13 @@ class MatchService:
                     home_team=formatted_data["home_team"],
                     away_team=formatted_data["away_team"],
                     league=formatted_data["league"],
-                    start_time=datetime.fromisoformat(formatted_data["start_time"].replace('Z', '+00:00')),
+                    start_time=datetime.fromisoformat(formatted_data["start_time"]),  # 3.11+ parses the trailing Z
                     status=formatted_data["status"],
                     home_score=formatted_data["home_score"],
                     away_score=formatted_data["away_score"]
                 )
                 db.add(new_match)
+                existing_matches[new_match.external_id] = new_match
                 synced_matches.append(new_match)
         
         db.commit()
@@ -103,66 +114,6 @@ class AlertService:
             )
         ).all()
     
-    @staticmethod
-    def check_alerts_for_match(db: Session, match: Match) -> List[Alert]:
-        """Check which alerts should be triggered for a given match"""
-        # Get all active alerts
-        active_alerts = db.query(Alert).filter(Alert.is_active == True).all()
-        triggered_alerts = []
-        
-        for alert in active_alerts:
-            # Check if alert applies to this match
-            if not AlertService._alert_applies_to_match(alert, match):
-                continue
-            
-            # Check if alert condition is met
-            if AlertService._check_alert_condition(alert, match):
-                triggered_alerts.append(alert)
-        
-        return triggered_alerts
-    
-    @staticmethod
-    def _alert_applies_to_match(alert: Alert, match: Match) -> bool:
-        """Check if alert applies to the given match"""
-        # Check team filter
-        if alert.team_filter:
-            if alert.team_filter.lower() not in [match.home_team.lower(), match.away_team.lower()]:
-                return False
-        
-        # Check league filter
-        if alert.league_filter:
-            if alert.league_filter.lower() not in match.league.lower():
-                return False
-        
-        return True
-    
-    @staticmethod
-    def _check_alert_condition(alert: Alert, match: Match) -> bool:
-        """Check if alert condition is met"""
-        # Get the relevant value based on alert type
-        if alert.alert_type == "home_score":
-            value = match.home_score
-        elif alert.alert_type == "away_score":
-            value = match.away_score
-        elif alert.alert_type == "total_goals":
-            value = match.home_score + match.away_score
-        else:
-            return False
-        
-        # Check condition
-        if alert.condition == "greater_than":
-            return value > alert.threshold
-        elif alert.condition == "less_than":
-            return value < alert.threshold
-        elif alert.condition == "equals":
-            return value == alert.threshold
-        elif alert.condition == "greater_than_or_equal":
-            return value >= alert.threshold
-        elif alert.condition == "less_than_or_equal":
-            return value <= alert.threshold
-        
-        return False
-    
     @staticmethod
     def record_alert_trigger(
         db: Session,
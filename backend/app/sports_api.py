@@ -1,5 +1,6 @@
 import os
 import httpx
+import orjson
 from typing import List, Dict, Optional
 from datetime import datetime, timedelta
 import asyncio
@@ -29,7 +30,7 @@ class SportsAPIService:
                     params={"live": "all"}
                 )
                 response.raise_for_status()
-                data = response.json()
+                data = orjson.loads(response.content)
                 return data.get("response", [])
             except Exception as e:
                 print(f"Error fetching live matches: {e}")
@@ -49,7 +50,7 @@ class SportsAPIService:
                     params={"date": today}
                 )
                 response.raise_for_status()
-                data = response.json()
+                data = orjson.loads(response.content)
                 return data.get("response", [])
             except Exception as e:
                 print(f"Error fetching today's matches: {e}")
@@ -68,7 +69,7 @@ class SportsAPIService:
                     params={"fixture": fixture_id}
                 )
                 response.raise_for_status()
-                data = response.json()
+                data = orjson.loads(response.content)
                 return data.get("response", [])
             except Exception as e:
                 print(f"Error fetching match statistics: {e}")
@@ -87,7 +88,7 @@ class SportsAPIService:
                     params={"league": league_id, "season": season}
                 )
                 response.raise_for_status()
-                data = response.json()
+                data = orjson.loads(response.content)
                 return data.get("response", [])
             except Exception as e:
                 print(f"Error fetching league matches: {e}")
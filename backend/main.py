@@ -1,21 +1,36 @@
-from fastapi import FastAPI, HTTPException, Depends
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
 from contextlib import asynccontextmanager
 import os
+import time
+import hashlib
 import asyncio
+import orjson
+import redis
 from dotenv import load_dotenv
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
-from app.database import engine, create_tables, get_db
-from app.models import Base, Alert
+from app.database import engine, create_tables, get_db, get_connection, SessionLocal
+from app.models import Base, Alert, AlertHistory, Match
 from app.sports_api import sports_api
-from app.services import MatchService, AlertService, UserService
+from app.services import MatchService, UserService
 from app.sms_service import sms_service
-from app.alert_engine import match_monitor
-from datetime import datetime
+from app.alert_engine import match_monitor, AlertType
+from app.monitoring import MonitoringService, MonitoringMiddleware
+from app.middleware import setup_middleware
+from app.responses import ORJSONResponse
+from datetime import datetime, timedelta
 
 # Load environment variables
 load_dotenv()
 
+# Monitoring is enabled when Redis is configured
+REDIS_URL = os.getenv("REDIS_URL")
+monitoring_service = MonitoringService(redis.Redis.from_url(REDIS_URL)) if REDIS_URL else None
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
@@ -26,66 +41,138 @@ async def lifespan(app: FastAPI):
     
     # Start alert engine in background
     try:
-        asyncio.create_task(match_monitor.start_monitoring())
+        match_monitor.start_background_monitoring()
         print("🚨 Alert engine started")
     except Exception as e:
         print(f"❌ Failed to start alert engine: {e}")
     
+    # Start monitoring when Redis is configured
+    metrics_task = None
+    if monitoring_service:
+        app.state.monitoring = monitoring_service
+        metrics_task = asyncio.create_task(monitoring_service.refresh_user_metrics())
+        print("📈 Monitoring started")
+    
     yield
     
     # Shutdown
     print("🛑 TouchLine Backend shutting down...")
-    match_monitor.stop_monitoring()
+    await match_monitor.stop_monitoring()
+    if metrics_task:
+        metrics_task.cancel()
 
 # Create FastAPI app
 app = FastAPI(
     title="TouchLine API",
     description="Sports alert system API",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
-# CORS middleware for frontend communication
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000"],  # Frontend URL
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Compress larger responses such as alert and match listings. Added first so
+# it sits inside the @app.middleware("http") layer: BaseHTTPMiddleware streams
+# bodies, and GZip only applies minimum_size to single-message responses
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=4)
+
+# CORS, security headers, request logging and rate limiting
+setup_middleware(app)
+
+# Request metrics middleware
+if monitoring_service:
+    app.add_middleware(MonitoringMiddleware, service=monitoring_service)
+
+@app.exception_handler(SQLAlchemyError)
+async def database_error_handler(request: Request, exc: SQLAlchemyError):
+    """Turn database failures into a 500; get_db closes and rolls back the session"""
+    return ORJSONResponse(status_code=500, content={"detail": f"Database error: {str(exc)}"})
+
+# Static payloads are serialized once at import time
+ROOT_JSON = orjson.dumps({"message": "TouchLine API is running! 🏈"})
+HEALTH_JSON = orjson.dumps({"status": "healthy", "service": "TouchLine Backend"})
 
 @app.get("/")
 async def root():
-    return {"message": "TouchLine API is running! 🏈"}
+    return Response(content=ROOT_JSON, media_type="application/json")
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "TouchLine Backend"}
+    return Response(content=HEALTH_JSON, media_type="application/json")
+
+# Rendered /api/status body, re-serialized only when the reported state changes
+_status_cache = (None, b"")  # (state tuple, rendered body)
 
 @app.get("/api/status")
 async def api_status():
-    return {
-        "backend": "running",
-        "database": "configured",
-        "sms_service": "configured" if sms_service.is_configured else "not_configured",
-        "sports_api": "configured" if sports_api.api_key else "not_configured",
-        "alert_engine": "running" if match_monitor.running else "stopped"
-    }
+    global _status_cache
+    state = (bool(sms_service.is_configured), bool(sports_api.api_key), match_monitor.running)
+    if state != _status_cache[0]:
+        sms_configured, sports_configured, engine_running = state
+        _status_cache = (state, orjson.dumps({
+            "backend": "running",
+            "database": "configured",
+            "sms_service": "configured" if sms_configured else "not_configured",
+            "sports_api": "configured" if sports_configured else "not_configured",
+            "alert_engine": "running" if engine_running else "stopped"
+        }))
+    return Response(content=_status_cache[1], media_type="application/json")
+
+def match_listing_response(matches: list) -> ORJSONResponse:
+    """Build the {"matches", "count"} listing shared by the match endpoints"""
+    # Match dicts hold only JSON-native values, so they skip jsonable_encoder
+    return ORJSONResponse({"matches": matches, "count": len(matches)})
+
+# Rendered sports API listings are reused briefly, so hot polling skips both
+# the sports API round-trip and per-match formatting
+MATCH_LISTING_TTL = 15  # seconds for live/today listings
+LEAGUE_LISTING_TTL = 60  # seconds for league fixture lists, which change slowly
+MATCH_LISTING_CACHE_SIZE = 128  # league/season keys come from clients, so bound them
+_match_listing_cache = {}  # listing key -> (monotonic timestamp, rendered body, etag), oldest first
+
+def listing_etag(body: bytes) -> str:
+    """Weak validator for a rendered listing; weak because GZip re-encodes the body"""
+    return f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+def listing_response(request: Request, body: bytes, etag: str) -> Response:
+    """Answer 304 when the client already holds this rendering of the listing"""
+    headers = {"ETag": etag}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def cached_match_listing(request: Request, key, fetch_matches, ttl: float = MATCH_LISTING_TTL) -> Response:
+    """Serve a sports API match listing from the short-lived render cache"""
+    now = time.monotonic()
+    cached = _match_listing_cache.get(key)
+    if cached and now - cached[0] <= ttl:
+        return listing_response(request, cached[1], cached[2])
+    
+    matches = await fetch_matches()
+    body = match_listing_response([sports_api.format_match_data(match) for match in matches]).body
+    etag = listing_etag(body)
+    # The sports API client returns [] on upstream errors, so an empty listing
+    # is never cached; one failed fetch would otherwise be served to everyone
+    if not matches:
+        return listing_response(request, body, etag)
+    
+    # Re-insert so the dict stays ordered by render time, then evict the oldest
+    _match_listing_cache.pop(key, None)
+    _match_listing_cache[key] = (now, body, etag)
+    if len(_match_listing_cache) > MATCH_LISTING_CACHE_SIZE:
+        del _match_listing_cache[next(iter(_match_listing_cache))]
+    return listing_response(request, body, etag)
 
 # Sports API endpoints
 @app.get("/api/matches/live")
-async def get_live_matches():
+async def get_live_matches(request: Request):
     """Get currently live matches"""
-    matches = await sports_api.get_live_matches()
-    formatted_matches = [sports_api.format_match_data(match) for match in matches]
-    return {"matches": formatted_matches, "count": len(formatted_matches)}
+    return await cached_match_listing(request, "live", sports_api.get_live_matches)
 
 @app.get("/api/matches/today")
-async def get_todays_matches():
+async def get_todays_matches(request: Request):
     """Get today's matches"""
-    matches = await sports_api.get_todays_matches()
-    formatted_matches = [sports_api.format_match_data(match) for match in matches]
-    return {"matches": formatted_matches, "count": len(formatted_matches)}
+    return await cached_match_listing(request, "today", sports_api.get_todays_matches)
 
 @app.get("/api/matches/{fixture_id}/statistics")
 async def get_match_statistics(fixture_id: int):
@@ -93,73 +180,59 @@ async def get_match_statistics(fixture_id: int):
     stats = await sports_api.get_match_statistics(fixture_id)
     if not stats:
         raise HTTPException(status_code=404, detail="Match statistics not found")
-    return {"statistics": stats}
+    # Raw sports API JSON is already encodable, so skip jsonable_encoder's deep walk
+    return ORJSONResponse({"statistics": stats})
 
 @app.get("/api/leagues/{league_id}/matches")
-async def get_league_matches(league_id: int, season: int = 2024):
+async def get_league_matches(request: Request, league_id: int, season: int = 2024):
     """Get matches for a specific league and season"""
-    matches = await sports_api.get_league_matches(league_id, season)
-    formatted_matches = [sports_api.format_match_data(match) for match in matches]
-    return {"matches": formatted_matches, "count": len(formatted_matches)}
+    return await cached_match_listing(
+        request,
+        ("league", league_id, season),
+        lambda: sports_api.get_league_matches(league_id, season),
+        ttl=LEAGUE_LISTING_TTL
+    )
 
 # Database endpoints
+# Handlers that run blocking SQLAlchemy queries are plain `def` so FastAPI
+# runs them in its threadpool instead of stalling the event loop
+# Match listings select plain column rows; orjson serializes start_time directly
+MATCH_LIST_COLUMNS = (
+    Match.id,
+    Match.external_id,
+    Match.home_team,
+    Match.away_team,
+    Match.league,
+    Match.start_time,
+    Match.status,
+    Match.home_score,
+    Match.away_score,
+)
+
 @app.get("/api/db/matches/live")
-async def get_db_live_matches():
+def get_db_live_matches(conn: Connection = Depends(get_connection)):
     """Get live matches from database"""
-    try:
-        db = next(get_db())
-        matches = MatchService.get_live_matches(db)
-        return {
-            "matches": [
-                {
-                    "id": match.id,
-                    "external_id": match.external_id,
-                    "home_team": match.home_team,
-                    "away_team": match.away_team,
-                    "league": match.league,
-                    "start_time": match.start_time.isoformat(),
-                    "status": match.status,
-                    "home_score": match.home_score,
-                    "away_score": match.away_score
-                }
-                for match in matches
-            ],
-            "count": len(matches)
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    matches = conn.execute(
+        select(*MATCH_LIST_COLUMNS).where(Match.status == "LIVE")
+    ).mappings().all()
+    return match_listing_response([dict(match) for match in matches])
 
 @app.get("/api/db/matches/today")
-async def get_db_todays_matches():
+def get_db_todays_matches(conn: Connection = Depends(get_connection)):
     """Get today's matches from database"""
-    try:
-        db = next(get_db())
-        matches = MatchService.get_todays_matches(db)
-        return {
-            "matches": [
-                {
-                    "id": match.id,
-                    "external_id": match.external_id,
-                    "home_team": match.home_team,
-                    "away_team": match.away_team,
-                    "league": match.league,
-                    "start_time": match.start_time.isoformat(),
-                    "status": match.status,
-                    "home_score": match.home_score,
-                    "away_score": match.away_score
-                }
-                for match in matches
-            ],
-            "count": len(matches)
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    today = datetime.now().date()
+    matches = conn.execute(
+        select(*MATCH_LIST_COLUMNS).where(
+            Match.start_time >= today,
+            Match.start_time < today + timedelta(days=1)
+        )
+    ).mappings().all()
+    return match_listing_response([dict(match) for match in matches])
 
 @app.post("/api/db/matches/sync")
-async def sync_matches():
+async def sync_matches(db: Session = Depends(get_db)):
     """Sync live matches from sports API to database"""
     try:
-        db = next(get_db())
         synced_matches = await MatchService.sync_live_matches(db)
         return {
             "message": f"Successfully synced {len(synced_matches)} matches",
@@ -170,141 +243,166 @@ async def sync_matches():
 
 # Alert endpoints
 @app.post("/api/alerts")
-async def create_alert(
+def create_alert(
     name: str,
     team: str,
-    alert_type: str,
+    alert_type: AlertType,
     threshold: float,
     description: str = "",
     user_phone: str = "",
     db: Session = Depends(get_db)
 ):
     """Create a new alert"""
-    try:
-        alert = Alert(
+    created_at = datetime.utcnow()
+    # RETURNING hands back the new id with the INSERT, so no refresh SELECT
+    alert_id = db.execute(
+        insert(Alert).values(
             name=name,
             team=team,
-            alert_type=alert_type,
+            alert_type=alert_type.value,
             threshold=threshold,
-            condition=f"{team} {alert_type} >= {threshold}",
+            condition=f"{team} {alert_type.value} >= {threshold}",
             user_phone=user_phone,
             is_active=True,
-            created_at=datetime.utcnow()
-        )
-        
-        db.add(alert)
-        db.commit()
-        db.refresh(alert)
-        
-        return {
-            "id": alert.id,
-            "name": alert.name,
-            "team": alert.team,
-            "alert_type": alert.alert_type,
-            "threshold": alert.threshold,
-            "description": description,  # Use the input description
-            "is_active": alert.is_active,
-            "created_at": alert.created_at.isoformat()
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error creating alert: {str(e)}")
+            created_at=created_at
+        ).returning(Alert.id)
+    ).scalar_one()
+    db.commit()
+    
+    return {
+        "id": alert_id,
+        "name": name,
+        "team": team,
+        "alert_type": alert_type.value,
+        "threshold": threshold,
+        "description": description,  # Use the input description
+        "is_active": True,
+        "created_at": created_at
+    }
+
+def stream_alert_listing(db: Session, alerts):
+    """Yield the alert listing JSON batch by batch as rows arrive from the cursor"""
+    try:
+        yield b'{"alerts":['
+        count = 0
+        for batch in alerts.partitions():
+            chunk = b",".join(orjson.dumps(dict(alert)) for alert in batch)
+            yield chunk if count == 0 else b"," + chunk
+            count += len(batch)
+        yield b'],"count":%d}' % count
+    finally:
+        db.close()
 
 @app.get("/api/alerts")
-async def get_all_alerts(db: Session = Depends(get_db)):
+def get_all_alerts():
     """Get all alerts"""
+    # The session outlives the handler while the body streams, so it is
+    # owned (and closed) by the generator instead of get_db
+    db = SessionLocal()
     try:
-        alerts = db.query(Alert).order_by(Alert.created_at.desc()).all()
-        return {
-            "alerts": [
-                {
-                    "id": alert.id,
-                    "name": alert.name,
-                    "team": alert.team,
-                    "alert_type": alert.alert_type,
-                    "threshold": alert.threshold,
-                    "description": alert.condition,  # Use condition as description
-                    "condition": alert.condition,
-                    "is_active": alert.is_active,
-                    "created_at": alert.created_at.isoformat()
-                }
-                for alert in alerts
-            ],
-            "count": len(alerts)
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching alerts: {str(e)}")
+        # Plain column rows from a server-side cursor, fetched 500 at a time
+        alerts = db.execute(
+            select(
+                Alert.id,
+                Alert.name,
+                Alert.team,
+                Alert.alert_type,
+                Alert.threshold,
+                Alert.condition.label("description"),  # Use condition as description
+                Alert.condition,
+                Alert.is_active,
+                Alert.created_at
+            ).order_by(Alert.created_at.desc()),
+            execution_options={"stream_results": True, "yield_per": 500}
+        ).mappings()
+    except Exception:
+        db.close()
+        raise
+    return StreamingResponse(stream_alert_listing(db, alerts), media_type="application/json")
 
 @app.put("/api/alerts/{alert_id}/toggle")
-async def toggle_alert(alert_id: int, db: Session = Depends(get_db)):
+def toggle_alert(alert_id: int, db: Session = Depends(get_db)):
     """Toggle alert active status"""
-    try:
-        alert = db.query(Alert).filter(Alert.id == alert_id).first()
-        if not alert:
-            raise HTTPException(status_code=404, detail="Alert not found")
-        
-        alert.is_active = not alert.is_active
-        db.commit()
-        
-        return {
-            "id": alert.id,
-            "is_active": alert.is_active,
-            "message": f"Alert {'activated' if alert.is_active else 'deactivated'}"
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error toggling alert: {str(e)}")
+    # A single UPDATE ... RETURNING flips the flag and reports whether the alert exists
+    alert = db.execute(
+        update(Alert)
+        .where(Alert.id == alert_id)
+        .values(is_active=~Alert.is_active)
+        .returning(Alert.id, Alert.is_active)
+    ).first()
+    db.commit()
+    
+    if not alert:
+        raise HTTPException(status_code=404, detail="Alert not found")
+    
+    return {
+        "id": alert.id,
+        "is_active": alert.is_active,
+        "message": f"Alert {'activated' if alert.is_active else 'deactivated'}"
+    }
 
 @app.delete("/api/alerts/{alert_id}")
-async def delete_alert(alert_id: int, db: Session = Depends(get_db)):
+def delete_alert(alert_id: int, db: Session = Depends(get_db)):
     """Delete an alert"""
-    try:
-        alert = db.query(Alert).filter(Alert.id == alert_id).first()
-        if not alert:
-            raise HTTPException(status_code=404, detail="Alert not found")
-        
-        db.delete(alert)
-        db.commit()
-        
-        return {"message": "Alert deleted successfully"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error deleting alert: {str(e)}")
+    # Detach history rows as the ORM delete did, then delete with RETURNING
+    # instead of loading the alert and its history first
+    db.execute(
+        update(AlertHistory)
+        .where(AlertHistory.alert_id == alert_id)
+        .values(alert_id=None)
+    )
+    deleted = db.execute(
+        delete(Alert).where(Alert.id == alert_id).returning(Alert.id)
+    ).first()
+    db.commit()
+    
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Alert not found")
+    
+    return {"message": "Alert deleted successfully"}
 
 @app.get("/api/alerts/stats")
-async def get_alert_stats(db: Session = Depends(get_db)):
+def get_alert_stats(db: Session = Depends(get_db)):
     """Get alert statistics"""
-    try:
-        total_alerts = db.query(Alert).count()
-        active_alerts = db.query(Alert).filter(Alert.is_active == True).count()
-        alerts_by_type = db.query(Alert.alert_type, db.func.count(Alert.id)).group_by(Alert.alert_type).all()
-        
-        return {
-            "total_alerts": total_alerts,
-            "active_alerts": active_alerts,
-            "inactive_alerts": total_alerts - active_alerts,
-            "alerts_by_type": dict(alerts_by_type)
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching alert stats: {str(e)}")
+    # One grouped scan yields both the active split and the per-type totals
+    rows = db.execute(
+        select(Alert.alert_type, Alert.is_active, func.count(Alert.id))
+        .group_by(Alert.alert_type, Alert.is_active)
+    ).all()
+    
+    total_alerts = active_alerts = 0
+    alerts_by_type = {}
+    for alert_type, is_active, count in rows:
+        total_alerts += count
+        if is_active:
+            active_alerts += count
+        alerts_by_type[alert_type] = alerts_by_type.get(alert_type, 0) + count
+    
+    return ORJSONResponse({
+        "total_alerts": total_alerts,
+        "active_alerts": active_alerts,
+        "inactive_alerts": total_alerts - active_alerts,
+        "alerts_by_type": alerts_by_type
+    })
 
 @app.get("/api/alerts/user/{user_id}")
-async def get_user_alerts(user_id: int, db: Session = Depends(get_db)):
+def get_user_alerts(user_id: int, db: Session = Depends(get_db)):
     """Get all alerts for a user"""
-    alerts = AlertService.get_user_alerts(db, user_id)
-    return {
-        "alerts": [
-            {
-                "id": alert.id,
-                "name": alert.name,
-                "alert_type": alert.alert_type,
-                "threshold": alert.threshold,
-                "condition": alert.condition,
-                "team_filter": alert.team_filter,
-                "league_filter": alert.league_filter,
-                "is_active": alert.is_active
-            }
-            for alert in alerts
-        ],
+    alerts = db.execute(
+        select(
+            Alert.id,
+            Alert.name,
+            Alert.alert_type,
+            Alert.threshold,
+            Alert.condition,
+            Alert.team,
+            Alert.is_active
+        ).where(Alert.user_id == user_id, Alert.is_active == True)
+    ).mappings().all()
+    return ORJSONResponse({
+        "alerts": [dict(alert) for alert in alerts],
         "count": len(alerts)
-    }
+    })
 
 # SMS and Alert Engine endpoints
 @app.post("/api/sms/test")
@@ -316,9 +414,8 @@ async def test_sms(to_number: str, message: str = "TouchLine SMS test"):
 @app.post("/api/alert-engine/start")
 async def start_alert_engine():
     """Start the alert monitoring engine"""
-    if not match_monitor.running:
-        # Start in background
-        asyncio.create_task(match_monitor.start_monitoring())
+    # Start in background; the monitor keeps the task so stop can cancel it
+    if match_monitor.start_background_monitoring():
         return {"message": "Alert engine started", "status": "running"}
     else:
         return {"message": "Alert engine already running", "status": "running"}
@@ -326,16 +423,24 @@ async def start_alert_engine():
 @app.post("/api/alert-engine/stop")
 async def stop_alert_engine():
     """Stop the alert monitoring engine"""
-    match_monitor.stop_monitoring()
+    await match_monitor.stop_monitoring()
     return {"message": "Alert engine stopped", "status": "stopped"}
 
+# Rendered engine status, re-serialized only when the engine's state changes
+_engine_status_cache = (None, b"")  # (state tuple, rendered body)
+
 @app.get("/api/alert-engine/status")
 async def get_alert_engine_status():
     """Get alert engine status"""
-    return {
-        "is_running": alert_engine.is_running,
-        "check_interval": alert_engine.check_interval
-    }
+    global _engine_status_cache
+    state = (match_monitor.running, match_monitor.monitoring_interval)
+    if state != _engine_status_cache[0]:
+        is_running, check_interval = state
+        _engine_status_cache = (state, orjson.dumps({
+            "is_running": is_running,
+            "check_interval": check_interval
+        }))
+    return Response(content=_engine_status_cache[1], media_type="application/json")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Test script for response compression
+Checks that small responses go out uncompressed and large ones are gzipped
+"""
+
+import sys
+import os
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+import main
+
+def test_compression():
+    """Small bodies skip GZip's minimum_size; large listings are compressed"""
+    print("🧪 Testing response compression...")
+    
+    with TestClient(main.app) as client:
+        for path in ("/health", "/api/status"):
+            response = client.get(path, headers={"Accept-Encoding": "gzip"})
+            print(f"{path}: {response.headers.get('content-encoding', 'identity')}, {len(response.content)} bytes")
+            assert response.status_code == 200
+            assert "content-encoding" not in response.headers
+            assert response.headers["content-length"] == str(len(response.content))
+        
+        async def many_matches():
+            return [{"fixture": {"id": fixture_id}} for fixture_id in range(50)]
+        
+        main.sports_api.get_live_matches = many_matches
+        main._match_listing_cache.clear()
+        response = client.get("/api/matches/live", headers={"Accept-Encoding": "gzip"})
+        print(f"/api/matches/live: {response.headers.get('content-encoding', 'identity')}")
+        assert response.headers.get("content-encoding") == "gzip"
+    
+    print("\n✅ Compression tests completed!")
+
+if __name__ == "__main__":
+    test_compression()